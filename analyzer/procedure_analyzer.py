@@ -1,23 +1,174 @@
 import re
-from typing import Dict, List, Any, Optional
+import string
+import functools
+import copy
+from typing import Dict, List, Any, Optional, Tuple
 import logging
 
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Patterns are compiled once at import time. Keyword patterns are case-sensitive and
+# run over a lowercased view of the definition (see _lower_keywords); captured text is
+# sliced from the original at the same offsets. Argument patterns capture literal text
+# and run case-insensitively over the original. All patterns stay on re: they are
+# linear as written, and RE2's per-call overhead on short argument slices (plus its
+# ASCII-only \w) made the analyzer slower and dropped non-ASCII identifiers.
+# A declaration ends at a semicolon or the end of its line, so a DECLARE without a
+# trailing semicolon no longer runs on into the following statements
+_VAR_RE = re.compile(r"\bdeclare\s+(@\w+)\s+([^;\r\n]+)")
+# Single pass over every EXEC sp_api_* statement; arguments are parsed per kind
+# Groups: 1 = call, 2 = kind
+_SP_API_RE = re.compile(r"exec\s+(sp_api_(\w+))")
+# A call's arguments may span lines and run up to the next EXEC or a semicolon
+# outside string literals
+_ARGS_END_RE = re.compile(r"(?:'[^']*'|[^';])*")
+_TEXT_ARGS_RE = re.compile(r"(?i)\s+@text\s*=\s*N?'([^']+)'(?:.*?@class\s*=\s*N?'([^']+)')?")
+_INPUT_ARGS_RE = re.compile(r"(?i)\s+@name\s*=\s*N?'([^']+)'(?:.*?@value\s*=\s*([^,\s]+))?(?:.*?@placeholder\s*=\s*N?'([^']+)')?")
+_BUTTON_ARGS_RE = re.compile(r"(?i)\s+@name\s*=\s*N?'([^']+)'(?:.*?@value\s*=\s*N?'([^']+)')?(?:.*?@class\s*=\s*N?'([^']+)')?")
+_TOAST_ARGS_RE = re.compile(r"(?i)\s+@text\s*=\s*N?'([^']+)'(?:.*?@class\s*=\s*N?'([^']+)')?(?:.*?@seconds\s*=\s*(\d+))?")
+# Block structure tokens for the control flow scanner. String literals, comments and
+# bracketed identifiers are matched (and ignored) so keywords inside them don't count;
+# BEGIN TRAN/TRANSACTION opens no block, and BEGIN TRY/CATCH is never an IF/WHILE body.
+# Block comments and bracketed identifiers only match their opening delimiter; the
+# scanner finds the close with str.find, since a lazy match up to a missing close is
+# retried from every later opener and goes quadratic.
+_BLOCK_TOKEN_RE = re.compile(
+    r"'[^']*(?:''[^']*)*'"
+    r"|--[^\n]*"
+    r"|(?P<comment>/\*)"
+    r"|(?P<bracket>\[)"
+    r"|(?P<terminator>;)"
+    r"|(?<![@#\w.])(?P<keyword>if|else|while|case|end|begin(?!\s+(?:tran|transaction|distributed)\b))\b"
+    r"(?P<handler>(?<=begin)\s+(?:try|catch)\b)?"
+)
+
+def _block_comment_end(text: str, pos: int) -> int:
+    """
+    Return the offset just past the block comment whose body starts at pos.
+    
+    T-SQL block comments nest, so each /* inside the comment needs its own */.
+    An unterminated comment runs to the end of the text.
+    """
+    depth = 1
+    next_open = text.find("/*", pos)
+    next_close = text.find("*/", pos)
+    while next_close != -1:
+        if next_open != -1 and next_open < next_close:
+            depth += 1
+            pos = next_open + 2
+        else:
+            depth -= 1
+            pos = next_close + 2
+            if depth == 0:
+                return pos
+                
+        # Delimiters overlapping the one just consumed ("/*/", "*/*") don't count
+        if next_open != -1 and next_open < pos:
+            next_open = text.find("/*", pos)
+        if next_close < pos:
+            next_close = text.find("*/", pos)
+            
+    return len(text)
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def _lower_keywords(text: str) -> str:
+    """
+    Return a lowercased view of text with the same length and offsets.
+    
+    str.lower() can change the length of non-ASCII text, so only ASCII letters
+    are folded in that case; all keywords matched against the view are ASCII.
+    """
+    if text.isascii():
+        return text.lower()
+    return text.translate(_ASCII_LOWER)
+
+# Statement prefixes located by the optional hyperscan prefilter. Every match of
+# _VAR_RE / _SP_API_RE starts with one of these, so the Python patterns only need
+# to be tried at the reported offsets.
+_VAR_ID = 0
+_SP_API_ID = 1
+_HS_DATABASE = None
+if hyperscan is not None:
+    try:
+        _HS_DATABASE = hyperscan.Database()
+        _HS_DATABASE.compile(
+            expressions=[rb"DECLARE\s+@", rb"EXEC\s+sp_api_"],
+            ids=[_VAR_ID, _SP_API_ID],
+            elements=2,
+            flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST] * 2
+        )
+    except Exception as e:
+        logger.warning(f"Falling back to re, hyperscan database failed to compile: {str(e)}")
+        _HS_DATABASE = None
+
+def _find_statement_starts(text: str) -> Optional[Dict[int, List[int]]]:
+    """
+    Locate DECLARE and EXEC sp_api_* statements in a single hyperscan pass.
+    
+    Returns:
+        Start offsets per prefix id, or None if hyperscan can't be used for this text
+    """
+    # Hyperscan reports byte offsets, which only line up with str offsets for ASCII
+    if _HS_DATABASE is None or not text.isascii():
+        return None
+        
+    starts = {_VAR_ID: [], _SP_API_ID: []}
+    
+    def on_match(pattern_id, start, end, flags, context):
+        starts[pattern_id].append(start)
+        
+    _HS_DATABASE.scan(text.encode("ascii"), match_event_handler=on_match)
+    return starts
+
+def _iter_matches(pattern, text: str, starts: Optional[List[int]] = None):
+    """
+    Yield non-overlapping matches of pattern, like pattern.finditer(text).
+    
+    When candidate start offsets are given, the pattern is only tried at those
+    offsets instead of searching the whole text.
+    """
+    if starts is None:
+        yield from pattern.finditer(text)
+        return
+        
+    end = 0
+    for start in starts:
+        if start < end:
+            continue
+        match = pattern.match(text, start)
+        if match:
+            end = match.end()
+            yield match
+
 class StoredProcedureAnalyzer:
     """
     Analyzer for T-SQL stored procedures, specialized for UI-related procedures.
     """
     
-    def __init__(self):
-        """Initialize the stored procedure analyzer."""
-        pass
+    def __init__(self, cache_size: int = 256):
+        """
+        Initialize the stored procedure analyzer.
+        
+        Args:
+            cache_size: Number of analyzed definitions to keep in memory
+        """
+        self._analyze_cached = functools.lru_cache(maxsize=cache_size)(self._analyze)
     
     def analyze_procedure(self, procedure_definition: str) -> Dict[str, Any]:
         """
         Analyze a stored procedure definition and extract metadata.
         
+        Results are cached per definition, so analyzing the same procedure
+        again reuses the previously computed metadata. Each call returns its
+        own copy, so callers may modify the result freely.
+        
         Args:
             procedure_definition: T-SQL definition of the procedure
             
@@ -27,25 +178,59 @@ class StoredProcedureAnalyzer:
         if not procedure_definition:
             return {}
             
+        return copy.deepcopy(self._analyze_cached(procedure_definition))
+    
+    def _analyze(self, procedure_definition: str) -> Dict[str, Any]:
+        """Run all extraction passes over a procedure definition."""
+        lowered = _lower_keywords(procedure_definition)
+        starts = _find_statement_starts(procedure_definition)
+        if starts is None:
+            variables = self._extract_variables(procedure_definition, lowered)
+            ui_components, api_calls = self._scan_api_calls(procedure_definition, lowered)
+        else:
+            variables = self._extract_variables(procedure_definition, lowered, starts[_VAR_ID])
+            ui_components, api_calls = self._scan_api_calls(procedure_definition, lowered, starts[_SP_API_ID])
+        control_flow = self._extract_control_flow(procedure_definition, lowered)
+        
         metadata = {
-            "variables": self._extract_variables(procedure_definition),
-            "ui_components": self._extract_ui_components(procedure_definition),
-            "control_flow": self._extract_control_flow(procedure_definition),
-            "api_calls": self._extract_api_calls(procedure_definition),
-            "summary": self._generate_summary(procedure_definition)
+            "variables": variables,
+            "ui_components": ui_components,
+            "control_flow": control_flow,
+            "api_calls": api_calls,
+            "summary": self._generate_summary(ui_components, variables, control_flow)
         }
         
         return metadata
     
-    def _extract_variables(self, procedure_definition: str) -> List[Dict[str, str]]:
+    def get_ui_components(self, procedure_definition: str) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Extract UI components from a procedure definition.
+        
+        Args:
+            procedure_definition: T-SQL definition of the procedure
+            
+        Returns:
+            Dictionary with UI component types as keys and lists of components as values
+        """
+        if not procedure_definition:
+            return {}
+            
+        return self._extract_ui_components(procedure_definition)
+    
+    def _extract_variables(self, procedure_definition: str, lowered: Optional[str] = None,
+                           starts: Optional[List[int]] = None) -> List[Dict[str, str]]:
         """Extract variable declarations from the procedure."""
+        if lowered is None:
+            lowered = _lower_keywords(procedure_definition)
+            
         variables = []
+        if "declare" not in lowered:
+            return variables
         
         # Match DECLARE statements
-        pattern = r"DECLARE\s+(@\w+)\s+([^;]+)(?:;|$)"
-        for match in re.finditer(pattern, procedure_definition, re.IGNORECASE):
-            var_name = match.group(1)
-            var_type = match.group(2).strip()
+        for match in _iter_matches(_VAR_RE, lowered, starts):
+            var_name = procedure_definition[match.start(1):match.end(1)]
+            var_type = procedure_definition[match.start(2):match.end(2)].strip()
             variables.append({
                 "name": var_name,
                 "type": var_type
@@ -55,6 +240,14 @@ class StoredProcedureAnalyzer:
     
     def _extract_ui_components(self, procedure_definition: str) -> Dict[str, List[Dict[str, Any]]]:
         """Extract UI components from the procedure."""
+        return self._scan_api_calls(procedure_definition)[0]
+    
+    def _scan_api_calls(self, procedure_definition: str, lowered: Optional[str] = None,
+                        starts: Optional[List[int]] = None) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
+        """Extract UI components and distinct API calls in a single pass over the procedure."""
+        if lowered is None:
+            lowered = _lower_keywords(procedure_definition)
+            
         components = {
             "modal_text": [],
             "modal_input": [],
@@ -62,97 +255,143 @@ class StoredProcedureAnalyzer:
             "toast": [],
             "other": []
         }
+        api_calls = []
+        seen_api_calls = set()
+        if "sp_api_" not in lowered:
+            return components, api_calls
         
-        # Modal text components
-        text_pattern = r"EXEC\s+sp_api_modal_text\s+@text\s*=\s*N?'([^']+)'(?:.*?@class\s*=\s*N?'([^']+)')?"
-        for match in re.finditer(text_pattern, procedure_definition, re.IGNORECASE):
-            components["modal_text"].append({
-                "text": match.group(1),
-                "class": match.group(2) if match.group(2) else ""
-            })
-        
-        # Modal input components
-        input_pattern = r"EXEC\s+sp_api_modal_input\s+@name\s*=\s*N?'([^']+)'(?:.*?@value\s*=\s*([^,\s]+))?(?:.*?@placeholder\s*=\s*N?'([^']+)')?"
-        for match in re.finditer(input_pattern, procedure_definition, re.IGNORECASE):
-            components["modal_input"].append({
-                "name": match.group(1),
-                "value_var": match.group(2) if match.group(2) else "",
-                "placeholder": match.group(3) if match.group(3) else ""
-            })
-        
-        # Modal button components
-        button_pattern = r"EXEC\s+sp_api_modal_button\s+@name\s*=\s*N?'([^']+)'(?:.*?@value\s*=\s*N?'([^']+)')?(?:.*?@class\s*=\s*N?'([^']+)')?"
-        for match in re.finditer(button_pattern, procedure_definition, re.IGNORECASE):
-            components["modal_button"].append({
-                "name": match.group(1),
-                "value": match.group(2) if match.group(2) else "",
-                "class": match.group(3) if match.group(3) else ""
-            })
-        
-        # Toast notifications
-        toast_pattern = r"EXEC\s+sp_api_toast\s+@text\s*=\s*N?'([^']+)'(?:.*?@class\s*=\s*N?'([^']+)')?(?:.*?@seconds\s*=\s*(\d+))?"
-        for match in re.finditer(toast_pattern, procedure_definition, re.IGNORECASE):
-            components["toast"].append({
-                "text": match.group(1),
-                "class": match.group(2) if match.group(2) else "",
-                "seconds": match.group(3) if match.group(3) else "3"
-            })
+        call_matches = list(_iter_matches(_SP_API_RE, lowered, starts))
+        for i, call_match in enumerate(call_matches):
+            api_call = procedure_definition[call_match.start(1):call_match.end(1)]
+            if api_call not in seen_api_calls:
+                seen_api_calls.add(api_call)
+                api_calls.append(api_call)
+            
+            kind = call_match.group(2)
+            next_start = call_matches[i + 1].start() if i + 1 < len(call_matches) else len(procedure_definition)
+            args = procedure_definition[call_match.end():next_start]
+            args = args[:_ARGS_END_RE.match(args).end()]
+            
+            if kind == "modal_text":
+                # Modal text components
+                match = _TEXT_ARGS_RE.match(args)
+                if match:
+                    components["modal_text"].append({
+                        "text": match.group(1),
+                        "class": match.group(2) if match.group(2) else ""
+                    })
+            elif kind == "modal_input":
+                # Modal input components
+                match = _INPUT_ARGS_RE.match(args)
+                if match:
+                    components["modal_input"].append({
+                        "name": match.group(1),
+                        "value_var": match.group(2) if match.group(2) else "",
+                        "placeholder": match.group(3) if match.group(3) else ""
+                    })
+            elif kind == "modal_button":
+                # Modal button components
+                match = _BUTTON_ARGS_RE.match(args)
+                if match:
+                    components["modal_button"].append({
+                        "name": match.group(1),
+                        "value": match.group(2) if match.group(2) else "",
+                        "class": match.group(3) if match.group(3) else ""
+                    })
+            elif kind == "toast":
+                # Toast notifications
+                match = _TOAST_ARGS_RE.match(args)
+                if match:
+                    components["toast"].append({
+                        "text": match.group(1),
+                        "class": match.group(2) if match.group(2) else "",
+                        "seconds": match.group(3) if match.group(3) else "3"
+                    })
         
-        return components
+        return components, api_calls
     
-    def _extract_control_flow(self, procedure_definition: str) -> List[Dict[str, Any]]:
-        """Extract control flow structures from the procedure."""
-        control_flow = []
+    def _extract_control_flow(self, procedure_definition: str, lowered: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Extract IF and WHILE blocks from the procedure.
         
-        # IF statements
-        if_pattern = r"IF\s+(.+?)\s+BEGIN\s+(.+?)\s+END"
-        for match in re.finditer(if_pattern, procedure_definition, re.IGNORECASE | re.DOTALL):
-            condition = match.group(1).strip()
-            body = match.group(2).strip()
-            control_flow.append({
-                "type": "if",
-                "condition": condition,
-                "body_length": len(body)
-            })
+        Walks the BEGIN/END token stream once with a stack, so nested blocks are
+        matched with their own END and the scan stays linear in the text length.
+        """
+        if lowered is None:
+            lowered = _lower_keywords(procedure_definition)
+            
+        control_flow = []
+        if "begin" not in lowered:
+            return control_flow
+            
+        open_blocks = []  # (type, condition, start, body_start); type is None for plain blocks
+        pending = None  # IF/WHILE waiting for its BEGIN: (type, start, condition_start)
         
-        # WHILE loops
-        while_pattern = r"WHILE\s+(.+?)\s+BEGIN\s+(.+?)\s+END"
-        for match in re.finditer(while_pattern, procedure_definition, re.IGNORECASE | re.DOTALL):
-            condition = match.group(1).strip()
-            body = match.group(2).strip()
-            control_flow.append({
-                "type": "while",
-                "condition": condition,
-                "body_length": len(body)
-            })
+        pos = 0
+        while True:
+            match = _BLOCK_TOKEN_RE.search(lowered, pos)
+            if not match:
+                break
+            pos = match.end()
             
-        return control_flow
+            if match.group("comment"):
+                pos = _block_comment_end(lowered, pos)
+                continue
+            if match.group("bracket"):
+                close = lowered.find("]", pos)
+                pos = close + 1 if close != -1 else len(lowered)
+                continue
+            if match.group("terminator"):
+                # A condition can't span statements, so a bare IF/WHILE ends here
+                pending = None
+                continue
+                
+            keyword = match.group("keyword")
+            if not keyword:
+                continue
+                
+            if keyword in ("if", "while"):
+                pending = (keyword, match.start(), match.end())
+            elif keyword == "else":
+                # Semicolons are optional, so ELSE also ends a single-statement IF
+                pending = None
+            elif keyword == "begin":
+                if match.group("handler"):
+                    pending = None
+                    open_blocks.append((None, None, match.start(), match.end()))
+                elif pending:
+                    condition = procedure_definition[pending[2]:match.start()].strip()
+                    open_blocks.append((pending[0], condition, pending[1], match.end()))
+                    pending = None
+                else:
+                    open_blocks.append((None, None, match.start(), match.end()))
+            elif keyword == "case":
+                open_blocks.append((None, None, match.start(), match.end()))
+            elif open_blocks:
+                block_type, condition, start, body_start = open_blocks.pop()
+                if block_type:
+                    body = procedure_definition[body_start:match.start()].strip()
+                    control_flow.append((start, {
+                        "type": block_type,
+                        "condition": condition,
+                        "body_length": len(body)
+                    }))
+                    
+        # Report blocks in source order; inner blocks close first
+        control_flow.sort(key=lambda item: item[0])
+        return [block for _, block in control_flow]
     
     def _extract_api_calls(self, procedure_definition: str) -> List[str]:
         """Extract API calls from the procedure."""
-        api_calls = []
-        
-        # Match EXEC sp_api_* calls
-        pattern = r"EXEC\s+(sp_api_\w+)"
-        for match in re.finditer(pattern, procedure_definition, re.IGNORECASE):
-            api_call = match.group(1)
-            if api_call not in api_calls:
-                api_calls.append(api_call)
-            
-        return api_calls
+        return self._scan_api_calls(procedure_definition)[1]
     
-    def _generate_summary(self, procedure_definition: str) -> str:
-        """Generate a summary of the procedure."""
+    def _generate_summary(self, ui_components: Dict[str, List[Dict[str, Any]]],
+                          variables: List[Dict[str, str]],
+                          control_flow: List[Dict[str, Any]]) -> str:
+        """Generate a summary of the procedure from already extracted metadata."""
         # Count UI components
-        ui_components = self._extract_ui_components(procedure_definition)
         total_components = sum(len(components) for components in ui_components.values())
         
-        # Count variables
-        variables = self._extract_variables(procedure_definition)
-        
-        # Count control flow structures
-        control_flow = self._extract_control_flow(procedure_definition)
-        
         # Generate summary
         summary = f"UI procedure with {total_components} UI components, {len(variables)} variables, and {len(control_flow)} control flow structures."
         
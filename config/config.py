@@ -2,9 +2,20 @@ import os
 import json
 import logging
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_DEFAULT_CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "config",
+    "config.json"
+)
+
 class Config:
     """Configuration manager for the application."""
     
@@ -15,11 +26,7 @@ class Config:
         Args:
             config_file: Path to configuration file
         """
-        self.config_file = config_file or os.path.join(
-            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-            "config",
-            "config.json"
-        )
+        self.config_file = config_file or _DEFAULT_CONFIG_PATH
         self.config = self._load_config()
         
     def _load_config(self):
@@ -31,13 +38,15 @@ class Config:
             "data_dir": os.environ.get("DATA_DIR", "data")
         }
         
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, "r") as f:
-                    file_config = json.load(f)
-                    config.update(file_config)
-            except Exception as e:
-                logger.warning(f"Error loading config file: {str(e)}")
+        try:
+            with open(self.config_file, "rb") as f:
+                data = f.read()
+            file_config = orjson.loads(data) if orjson else json.loads(data)
+            config.update(file_config)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Error loading config file: {str(e)}")
                 
         return config
         
@@ -46,8 +55,12 @@ class Config:
         os.makedirs(os.path.dirname(self.config_file), exist_ok=True)
         
         try:
-            with open(self.config_file, "w") as f:
-                json.dump(self.config, f, indent=2)
+            if orjson:
+                data = orjson.dumps(self.config, option=orjson.OPT_INDENT_2)
+            else:
+                data = json.dumps(self.config, indent=2).encode("utf-8")
+            with open(self.config_file, "wb") as f:
+                f.write(data)
             return True
         except Exception as e:
             logger.error(f"Error saving config file: {str(e)}")
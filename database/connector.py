@@ -1,13 +1,14 @@
-import pyodbc
-import sqlalchemy as sa
-from sqlalchemy import create_engine, text
 import os
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Mapping
+from analyzer.procedure_analyzer import StoredProcedureAnalyzer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# SQLAlchemy and the pyodbc driver are imported where they are first needed so
+# importing this module stays cheap
+
 class SQLServerConnector:
     """
     Connector for SQL Server Express with Windows authentication,
@@ -26,6 +27,7 @@ class SQLServerConnector:
         self.database = database
         self.connection_string = f"Driver={{SQL Server}};Server={server};Database={database};Trusted_Connection=yes;"
         self.engine = None
+        self.analyzer = StoredProcedureAnalyzer()
         
     def connect(self) -> bool:
         """
@@ -35,6 +37,9 @@ class SQLServerConnector:
             bool: True if connection successful, False otherwise
         """
         try:
+            import pyodbc  # driver used by the mssql+pyodbc dialect
+            from sqlalchemy import create_engine, text
+            
             self.engine = create_engine(f"mssql+pyodbc:///?odbc_connect={self.connection_string}")
             # Test connection
             with self.engine.connect() as conn:
@@ -45,7 +50,7 @@ class SQLServerConnector:
             logger.error(f"Failed to connect to database: {str(e)}")
             return False
     
-    def get_stored_procedures(self, filter_ui_only: bool = False) -> List[Dict[str, Any]]:
+    def get_stored_procedures(self, filter_ui_only: bool = False) -> List[Mapping[str, Any]]:
         """
         Retrieve stored procedures from the database.
         
@@ -53,12 +58,14 @@ class SQLServerConnector:
             filter_ui_only: If True, only return UI-related stored procedures
             
         Returns:
-            List of dictionaries containing stored procedure information
+            List of read-only mappings containing stored procedure information
         """
         if not self.engine:
             logger.error("Not connected to database. Call connect() first.")
             return []
             
+        from sqlalchemy import text
+        
         try:
             query = """
             SELECT 
@@ -74,25 +81,24 @@ class SQLServerConnector:
             
             if filter_ui_only:
                 # Filter for UI-related stored procedures (those that use sp_api_* procedures)
-                query = """
-                SELECT DISTINCT
-                    r.ROUTINE_SCHEMA as schema_name,
-                    r.ROUTINE_NAME as procedure_name,
-                    r.CREATED as created_date,
-                    r.LAST_ALTERED as modified_date
+                query = r"""
+                SELECT 
+                    s.name as schema_name,
+                    p.name as procedure_name,
+                    p.create_date as created_date,
+                    p.modify_date as modified_date
                 FROM 
-                    INFORMATION_SCHEMA.ROUTINES r
+                    sys.procedures p
+                    INNER JOIN sys.schemas s ON p.schema_id = s.schema_id
+                    INNER JOIN sys.sql_modules m ON m.object_id = p.object_id
                 WHERE 
-                    r.ROUTINE_TYPE = 'PROCEDURE'
-                    AND (
-                        OBJECT_DEFINITION(OBJECT_ID(r.ROUTINE_SCHEMA + '.' + r.ROUTINE_NAME)) LIKE '%sp_api_%'
-                        OR OBJECT_DEFINITION(OBJECT_ID(r.ROUTINE_SCHEMA + '.' + r.ROUTINE_NAME)) LIKE '%modal%'
-                    )
+                    m.definition LIKE N'%sp\_api\_%' ESCAPE '\'
+                    OR m.definition LIKE N'%modal%'
                 """
                 
             with self.engine.connect() as conn:
                 result = conn.execute(text(query))
-                procedures = [dict(row) for row in result]
+                procedures = result.mappings().all()
                 logger.info(f"Retrieved {len(procedures)} stored procedures")
                 return procedures
                 
@@ -115,13 +121,17 @@ class SQLServerConnector:
             logger.error("Not connected to database. Call connect() first.")
             return None
             
+        from sqlalchemy import text
+        
         try:
-            query = f"""
-            SELECT OBJECT_DEFINITION(OBJECT_ID('{schema_name}.{procedure_name}')) as definition
-            """
+            # Bound parameters keep the name out of the SQL text, so the server
+            # caches a single plan for every procedure
+            query = text("""
+            SELECT OBJECT_DEFINITION(OBJECT_ID(:qualified_name)) as definition
+            """).bindparams(qualified_name=f"{schema_name}.{procedure_name}")
             
             with self.engine.connect() as conn:
-                result = conn.execute(text(query))
+                result = conn.execute(query)
                 row = result.fetchone()
                 if row and row[0]:
                     return row[0]
@@ -133,7 +143,63 @@ class SQLServerConnector:
             logger.error(f"Error retrieving procedure definition: {str(e)}")
             return None
     
-    def get_procedure_parameters(self, schema_name: str, procedure_name: str) -> List[Dict[str, Any]]:
+    def get_procedure_definitions(self, filter_ui_only: bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the T-SQL definitions of all stored procedures in one query.
+        
+        Args:
+            filter_ui_only: If True, only return UI-related stored procedures
+            
+        Yields:
+            Dictionaries with schema_name, procedure_name and definition keys
+            
+        Raises:
+            Exception: If the query fails; a partial stream must not be mistaken
+                for the full catalogue
+        """
+        if not self.engine:
+            logger.error("Not connected to database. Call connect() first.")
+            return
+            
+        from sqlalchemy import text
+        
+        try:
+            query = """
+            SELECT 
+                s.name as schema_name,
+                p.name as procedure_name,
+                m.definition
+            FROM 
+                sys.procedures p
+                INNER JOIN sys.schemas s ON p.schema_id = s.schema_id
+                INNER JOIN sys.sql_modules m ON m.object_id = p.object_id
+            """
+            
+            if filter_ui_only:
+                # Filter for UI-related stored procedures (those that use sp_api_* procedures)
+                query += r"""
+            WHERE 
+                m.definition LIKE N'%sp\_api\_%' ESCAPE '\'
+                OR m.definition LIKE N'%modal%'
+            """
+                
+            with self.engine.connect() as conn:
+                result = conn.execution_options(stream_results=True).execute(text(query))
+                count = 0
+                for row in result:
+                    count += 1
+                    yield {
+                        "schema_name": row.schema_name,
+                        "procedure_name": row.procedure_name,
+                        "definition": row.definition
+                    }
+                logger.info(f"Retrieved {count} procedure definitions")
+                
+        except Exception as e:
+            logger.error(f"Error retrieving procedure definitions: {str(e)}")
+            raise
+    
+    def get_procedure_parameters(self, schema_name: str, procedure_name: str) -> List[Mapping[str, Any]]:
         """
         Get the parameters of a stored procedure.
         
@@ -142,14 +208,16 @@ class SQLServerConnector:
             procedure_name: Name of the procedure
             
         Returns:
-            List of dictionaries containing parameter information
+            List of read-only mappings containing parameter information
         """
         if not self.engine:
             logger.error("Not connected to database. Call connect() first.")
             return []
             
+        from sqlalchemy import text
+        
         try:
-            query = f"""
+            query = text("""
             SELECT 
                 p.name as parameter_name,
                 t.name as data_type,
@@ -161,12 +229,12 @@ class SQLServerConnector:
                 INNER JOIN sys.procedures sp ON p.object_id = sp.object_id
                 INNER JOIN sys.schemas s ON sp.schema_id = s.schema_id
             WHERE 
-                s.name = '{schema_name}' AND sp.name = '{procedure_name}'
-            """
+                s.name = :schema_name AND sp.name = :procedure_name
+            """).bindparams(schema_name=schema_name, procedure_name=procedure_name)
             
             with self.engine.connect() as conn:
-                result = conn.execute(text(query))
-                parameters = [dict(row) for row in result]
+                result = conn.execute(query)
+                parameters = result.mappings().all()
                 logger.info(f"Retrieved {len(parameters)} parameters for {schema_name}.{procedure_name}")
                 return parameters
                 
@@ -184,53 +252,4 @@ class SQLServerConnector:
         Returns:
             Dictionary with UI component types as keys and lists of components as values
         """
-        if not procedure_definition:
-            return {}
-            
-        components = {
-            "modal_text": [],
-            "modal_input": [],
-            "modal_button": [],
-            "toast": [],
-            "other": []
-        }
-        
-        # Extract sp_api_modal_text components
-        import re
-        
-        # Modal text components
-        text_pattern = r"EXEC\s+sp_api_modal_text\s+@text\s*=\s*N?'([^']+)'(?:.*?@class\s*=\s*N?'([^']+)')?"
-        for match in re.finditer(text_pattern, procedure_definition, re.IGNORECASE):
-            components["modal_text"].append({
-                "text": match.group(1),
-                "class": match.group(2) if match.group(2) else ""
-            })
-        
-        # Modal input components
-        input_pattern = r"EXEC\s+sp_api_modal_input\s+@name\s*=\s*N?'([^']+)'(?:.*?@value\s*=\s*([^,\s]+))?(?:.*?@placeholder\s*=\s*N?'([^']+)')?"
-        for match in re.finditer(input_pattern, procedure_definition, re.IGNORECASE):
-            components["modal_input"].append({
-                "name": match.group(1),
-                "value_var": match.group(2) if match.group(2) else "",
-                "placeholder": match.group(3) if match.group(3) else ""
-            })
-        
-        # Modal button components
-        button_pattern = r"EXEC\s+sp_api_modal_button\s+@name\s*=\s*N?'([^']+)'(?:.*?@value\s*=\s*N?'([^']+)')?(?:.*?@class\s*=\s*N?'([^']+)')?"
-        for match in re.finditer(button_pattern, procedure_definition, re.IGNORECASE):
-            components["modal_button"].append({
-                "name": match.group(1),
-                "value": match.group(2) if match.group(2) else "",
-                "class": match.group(3) if match.group(3) else ""
-            })
-        
-        # Toast notifications
-        toast_pattern = r"EXEC\s+sp_api_toast\s+@text\s*=\s*N?'([^']+)'(?:.*?@class\s*=\s*N?'([^']+)')?(?:.*?@seconds\s*=\s*(\d+))?"
-        for match in re.finditer(toast_pattern, procedure_definition, re.IGNORECASE):
-            components["toast"].append({
-                "text": match.group(1),
-                "class": match.group(2) if match.group(2) else "",
-                "seconds": match.group(3) if match.group(3) else "3"
-            })
-        
-        return components
+        return self.analyzer.get_ui_components(procedure_definition)
@@ -1,8 +1,6 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
+import io
 import logging
-from langchain.prompts import PromptTemplate
-from langchain.llms import OpenAI
-from langchain.chains import LLMChain
 import os
 
 logging.basicConfig(level=logging.INFO)
@@ -13,25 +11,30 @@ class TSQLCodeGenerator:
     Generate T-SQL code for UI-related stored procedures.
     """
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, model: str = "gpt-4o-mini", temperature: float = 0.2):
         """
         Initialize the code generator.
         
         Args:
             api_key: OpenAI API key (if None, will look for OPENAI_API_KEY environment variable)
+            model: OpenAI chat model used for generation
+            temperature: Sampling temperature
         """
+        # The OpenAI client is imported on first use so that importing this module stays cheap
+        from openai import OpenAI
+        
         if api_key:
             os.environ["OPENAI_API_KEY"] = api_key
             
-        self.llm = OpenAI(temperature=0.2)
+        self.client = OpenAI()
+        self.model = model
+        self.temperature = temperature
         self.setup_prompts()
         
     def setup_prompts(self):
         """Set up prompt templates for code generation."""
         # Prompt for generating UI procedure
-        self.ui_procedure_prompt = PromptTemplate(
-            input_variables=["description", "similar_procedures"],
-            template="""
+        self.ui_procedure_template = """
             You are an expert T-SQL developer specializing in creating UI-related stored procedures.
             
             Create a T-SQL stored procedure that implements the following UI:
@@ -50,17 +53,9 @@ class TSQLCodeGenerator:
             
             Return only the complete T-SQL code without any additional explanation.
             """
-        )
-        
-        self.ui_procedure_chain = LLMChain(
-            llm=self.llm,
-            prompt=self.ui_procedure_prompt
-        )
         
         # Prompt for modifying existing procedure
-        self.modify_procedure_prompt = PromptTemplate(
-            input_variables=["original_code", "modification_request"],
-            template="""
+        self.modify_procedure_template = """
             You are an expert T-SQL developer specializing in UI-related stored procedures.
             
             Here is an existing T-SQL stored procedure:
@@ -78,20 +73,46 @@ class TSQLCodeGenerator:
             
             Return only the complete modified T-SQL code without any additional explanation.
             """
-        )
+    
+    def _complete(self, prompt: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """
+        Send a prompt to the chat completions API and collect the streamed reply.
         
-        self.modify_procedure_chain = LLMChain(
-            llm=self.llm,
-            prompt=self.modify_procedure_prompt
+        Args:
+            prompt: Fully formatted prompt
+            on_token: Optional callback invoked with each chunk of text as it arrives
+            
+        Returns:
+            The complete reply text
+        """
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=self.temperature,
+            stream=True
         )
+        
+        reply = io.StringIO()
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                reply.write(content)
+                if on_token:
+                    on_token(content)
+                    
+        return reply.getvalue()
     
-    def generate_ui_procedure(self, description: str, similar_procedures: List[Dict[str, Any]]) -> str:
+    def generate_ui_procedure(self, description: str, similar_procedures: List[Dict[str, Any]],
+                              on_token: Optional[Callable[[str], None]] = None) -> str:
         """
         Generate a new UI-related stored procedure.
         
         Args:
             description: Description of what the procedure should do
             similar_procedures: List of similar procedures for reference
+            on_token: Optional callback invoked with each chunk of code as it is generated
             
         Returns:
             Generated T-SQL code
@@ -105,9 +126,12 @@ class TSQLCodeGenerator:
             
         # Generate code
         try:
-            result = self.ui_procedure_chain.run(
-                description=description,
-                similar_procedures=similar_procs_text
+            result = self._complete(
+                self.ui_procedure_template.format(
+                    description=description,
+                    similar_procedures=similar_procs_text
+                ),
+                on_token
             )
             
             logger.info(f"Generated UI procedure code ({len(result)} characters)")
@@ -117,21 +141,26 @@ class TSQLCodeGenerator:
             logger.error(f"Error generating UI procedure: {str(e)}")
             return f"Error generating code: {str(e)}"
     
-    def modify_procedure(self, original_code: str, modification_request: str) -> str:
+    def modify_procedure(self, original_code: str, modification_request: str,
+                         on_token: Optional[Callable[[str], None]] = None) -> str:
         """
         Modify an existing stored procedure.
         
         Args:
             original_code: Original T-SQL code
             modification_request: Description of the requested modifications
+            on_token: Optional callback invoked with each chunk of code as it is generated
             
         Returns:
             Modified T-SQL code
         """
         try:
-            result = self.modify_procedure_chain.run(
-                original_code=original_code,
-                modification_request=modification_request
+            result = self._complete(
+                self.modify_procedure_template.format(
+                    original_code=original_code,
+                    modification_request=modification_request
+                ),
+                on_token
             )
             
             logger.info(f"Modified procedure code ({len(result)} characters)")
@@ -1,30 +1,122 @@
-from sentence_transformers import SentenceTransformer
-import faiss
 import numpy as np
+import functools
+import math
 import os
+import json
+import hashlib
 import pickle
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterable, Tuple
 import logging
+from utils.pipeline import batched
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# sentence_transformers (torch), faiss and pyarrow are imported where they are
+# first needed so importing this module stays cheap
+
+# Exact search is fast enough for small corpora. Past SQ_MIN_PROCEDURES there are
+# enough vectors to train an int8 scalar quantizer, and past HNSW_MIN_PROCEDURES
+# a graph index over int8 vectors takes over. A wide construction beam builds a
+# better graph once, and efSearch is set for high recall at the small k used for
+# retrieval. Quantized indexes fetch RERANK_OVERFETCH times more candidates, which
+# are rescored against the exact vectors when they're in memory.
+SQ_MIN_PROCEDURES = 256
+HNSW_MIN_PROCEDURES = 1000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+RERANK_OVERFETCH = 1.2
+
+# Parallel exact search gives each worker at least this many rows
+PARALLEL_MIN_ROWS = 1024
+
+# Larger batches keep a GPU busy; on CPU they only add memory pressure
+GPU_BATCH_SIZE = 128
+CPU_BATCH_SIZE = 64
+
+# Bit per UI component type in the per-procedure component mask
+COMPONENT_BITS = {"modal_text": 1, "modal_input": 2, "modal_button": 4, "toast": 8}
+
+def _component_mask(metadata: Dict[str, Any]) -> int:
+    """Return the bitmask of the UI component types a procedure uses."""
+    components = metadata.get("ui_components", {})
+    return sum(bit for name, bit in COMPONENT_BITS.items() if components.get(name))
+
+@functools.lru_cache(maxsize=1)
+def _get_model(model_name: str, device: str):
+    """
+    Load a sentence-transformers model once per process.
+    
+    Every ProcedureEmbeddings created with the same model and device shares it,
+    so constructing another one doesn't reload the weights from disk.
+    """
+    from sentence_transformers import SentenceTransformer
+    
+    return SentenceTransformer(model_name, device=device)
+
+def _dumps_json(value: Any):
+    """Serialize procedure metadata to JSON, with orjson when it's installed."""
+    return orjson.dumps(value) if orjson else json.dumps(value)
+
+def _loads_json(data) -> Any:
+    """Parse procedure metadata serialized by _dumps_json."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def _fingerprint(text: str) -> bytes:
+    """Return a digest of a procedure definition, used to skip re-encoding unchanged text."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
 class ProcedureEmbeddings:
     """
     Generate and store embeddings for T-SQL stored procedures.
     """
     
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", batch_size: Optional[int] = None,
+                 device: Optional[str] = None):
         """
         Initialize the embeddings generator.
         
         Args:
             model_name: Name of the sentence-transformers model to use
+            batch_size: Number of procedures to encode per model call; defaults to
+                GPU_BATCH_SIZE on a GPU and CPU_BATCH_SIZE otherwise
+            device: Torch device to run the model on; defaults to CUDA when available
         """
+        import torch
+        
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            
         self.model_name = model_name
-        self.model = SentenceTransformer(model_name)
+        self.device = device
+        self.model = _get_model(model_name, device)
+        self.batch_size = batch_size or (GPU_BATCH_SIZE if device.startswith("cuda") else CPU_BATCH_SIZE)
         self.index = None
         self.procedure_data = []
+        self._table = None
+        self._pending = []
+        self._vectors = []
+        self._positions = {}
+        self._fingerprints = {}
+        # COMPONENT_BITS mask of each stored procedure, by position
+        self._component_mask = np.zeros(0, dtype=np.uint8)
+        # Set when procedures were replaced in the exact vectors but not yet in the
+        # FAISS index, which is rebuilt once on the next flush
+        self._index_stale = False
+        # Incremented whenever the indexed procedures change, so callers can invalidate caches
+        self.generation = 0
+        # FAISS GPU state, set up on the first search
+        self._gpu_available = None
+        self._gpu_resources = None
+        self._gpu_index = None
+        self._gpu_generation = None
         self.embedding_dim = self.model.get_sentence_embedding_dimension()
         
     def generate_embedding(self, text: str) -> np.ndarray:
@@ -35,9 +127,36 @@ class ProcedureEmbeddings:
             text: Text to generate embedding for
             
         Returns:
-            Numpy array containing the embedding
+            Numpy array containing the L2-normalized embedding
+        """
+        import torch
+        
+        with torch.inference_mode():
+            return self.model.encode(text, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+    
+    def generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Generate embeddings for a batch of texts in as few model calls as possible.
+        
+        Args:
+            texts: Texts to generate embeddings for
+            
+        Returns:
+            Numpy array of shape (len(texts), embedding_dim) with L2-normalized rows
         """
-        return self.model.encode(text)
+        import torch
+        
+        with torch.inference_mode():
+            embeddings = self.model.encode(
+                texts,
+                batch_size=self.batch_size,
+                convert_to_tensor=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+        # Embeddings stay on the device until the whole batch is done, then
+        # come back to the host in a single copy
+        return embeddings.cpu().numpy().astype("float32")
     
     def add_procedure(self, procedure_id: str, procedure_name: str, procedure_text: str, metadata: Dict[str, Any]) -> None:
         """
@@ -48,61 +167,551 @@ class ProcedureEmbeddings:
             procedure_name: Name of the procedure
             procedure_text: T-SQL definition of the procedure
             metadata: Additional metadata about the procedure
+            
+        Procedures are staged and encoded in batches; call flush() to encode
+        anything still staged (search and save do this automatically). A
+        procedure that is already indexed with the same text isn't re-encoded;
+        only its name and metadata are updated.
         """
-        # Generate embedding
-        embedding = self.generate_embedding(procedure_text)
-        
-        # Store procedure data
-        self.procedure_data.append({
+        item = {
             "id": procedure_id,
             "name": procedure_name,
             "text": procedure_text,
             "metadata": metadata
-        })
+        }
+        if self._fingerprints.get(procedure_id) == _fingerprint(procedure_text):
+            if self._refresh_unchanged(item):
+                self.generation += 1
+            return
+            
+        self._pending.append(item)
         
-        # Add to index if it exists, otherwise create it
-        if self.index is None:
-            self.index = faiss.IndexFlatL2(self.embedding_dim)
-            faiss.normalize_L2(embedding.reshape(1, -1))
-            self.index.add(embedding.reshape(1, -1))
+        if len(self._pending) >= self.batch_size:
+            self._encode_pending()
+    
+    def add_procedures_bulk(self, items: List[Dict[str, Any]]) -> None:
+        """
+        Add several procedures to the index with a single batched encode.
+        
+        Procedures already indexed with the same text aren't re-encoded, but their
+        name and metadata are updated; procedures whose id is indexed with
+        different text replace the existing entry.
+        
+        Args:
+            items: Procedures as dictionaries with id, name, text and metadata keys
+        """
+        changed = self._changed_items(items)
+        if not changed:
+            return
+            
+        # Generate all embeddings in one batched call
+        embeddings = self.generate_embeddings([item["text"] for item, _ in changed])
+        self._add_encoded(changed, embeddings)
+    
+    def add_procedures_stream(self, items: Iterable[Dict[str, Any]]) -> None:
+        """
+        Add procedures from an iterable, overlapping encoding with producing items.
+        
+        Items are encoded batch_size at a time on a background thread while the
+        next batch is pulled from the iterable (e.g. fetched and analyzed); the
+        index itself is only updated from the calling thread. If any procedure was
+        replaced, the FAISS index is rebuilt once on the next flush (search,
+        retain_procedures and save flush first) rather than once per batch.
+        
+        Args:
+            items: Procedures as dictionaries with id, name, text and metadata keys
+        """
+        self._encode_pending()
+        
+        with ThreadPoolExecutor(max_workers=1) as encoder:
+            in_flight = None
+            for batch in batched(items, self.batch_size):
+                changed = self._changed_items(batch)
+                if not changed:
+                    continue
+                    
+                future = encoder.submit(self.generate_embeddings, [item["text"] for item, _ in changed])
+                if in_flight:
+                    self._add_encoded(in_flight[0], in_flight[1].result())
+                in_flight = (changed, future)
+                
+            if in_flight:
+                self._add_encoded(in_flight[0], in_flight[1].result())
+    
+    def _changed_items(self, items: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], bytes]]:
+        """
+        Return the items, with their fingerprints, that aren't indexed with the same text.
+        
+        Items whose text is unchanged skip encoding, but their stored name and
+        metadata are refreshed so analyzer changes still reach the index.
+        """
+        changed = []
+        refreshed = False
+        for item in items:
+            fingerprint = _fingerprint(item["text"])
+            if self._fingerprints.get(item["id"]) != fingerprint:
+                changed.append((item, fingerprint))
+            elif self._refresh_unchanged(item):
+                refreshed = True
+        if refreshed:
+            self.generation += 1
+        return changed
+    
+    def _refresh_unchanged(self, item: Dict[str, Any]) -> bool:
+        """
+        Update the name and metadata of a procedure indexed with the same text.
+        
+        Returns:
+            True if the stored procedure changed
+        """
+        position = self._positions[item["id"]]
+        stored = self._get_procedure(position)
+        if stored["name"] == item["name"] and stored["metadata"] == item["metadata"]:
+            return False
+            
+        self._materialize_table()
+        self.procedure_data[position] = {
+            "id": item["id"],
+            "name": item["name"],
+            "text": stored["text"],
+            "metadata": item["metadata"]
+        }
+        self._component_mask[position] = _component_mask(item["metadata"])
+        return True
+    
+    def _add_encoded(self, changed: List[Tuple[Dict[str, Any], bytes]], embeddings: np.ndarray) -> None:
+        """Store encoded procedures and add or replace their vectors in the index."""
+        self._materialize_table()
+        
+        # Store procedure data
+        new_rows = []
+        updated_rows = {}
+        masks = {}
+        for row, (item, fingerprint) in enumerate(changed):
+            record = {
+                "id": item["id"],
+                "name": item["name"],
+                "text": item["text"],
+                "metadata": item["metadata"]
+            }
+            position = self._positions.get(item["id"])
+            if position is None:
+                position = len(self.procedure_data)
+                self._positions[item["id"]] = position
+                self.procedure_data.append(record)
+                new_rows.append(row)
+            else:
+                # Also covers an id repeated within the batch; the last occurrence wins
+                self.procedure_data[position] = record
+                updated_rows[position] = row
+            masks[position] = _component_mask(item["metadata"])
+            self._fingerprints[item["id"]] = fingerprint
+            
+        # Positions may point past the current masks, so extend before writing them
+        self._component_mask = np.concatenate([self._component_mask, np.zeros(len(new_rows), dtype=np.uint8)])
+        self._component_mask[list(masks)] = list(masks.values())
+        self.generation += 1
+            
+        new_embeddings = embeddings[new_rows]
+        
+        if updated_rows or self._index_stale:
+            # FAISS indexes can't update rows in place, so the changes go into the
+            # exact vectors and the index is rebuilt from them on the next flush
+            if self.index is None and not self._index_stale:
+                vectors = new_embeddings
+            else:
+                vectors = np.concatenate([self._exact_vectors(), new_embeddings])
+            for position, row in updated_rows.items():
+                vectors[position] = embeddings[row]
+            self._vectors = [vectors]
+            self._index_stale = True
+        else:
+            # Keep the exact vectors so the index can be rebuilt as the corpus grows
+            self._vectors.append(new_embeddings)
+            
+            if self.index is None:
+                self.index = self._build_index(new_embeddings)
+            else:
+                self.index.add(new_embeddings)
+                if type(self.index) is not self._index_class_for(self.index.ntotal):
+                    self.index = self._build_index(self._exact_vectors())
+            
+        logger.info(f"Added {len(new_rows)} and updated {len(updated_rows)} procedures in index")
+    
+    def retain_procedures(self, procedure_ids) -> int:
+        """
+        Remove every indexed procedure whose id is not in procedure_ids.
+        
+        Args:
+            procedure_ids: Ids of the procedures to keep
+            
+        Returns:
+            Number of procedures removed
+        """
+        self._encode_pending()
+        
+        keep_ids = set(procedure_ids)
+        self._materialize_table()
+        keep = [i for i, proc in enumerate(self.procedure_data) if proc["id"] in keep_ids]
+        removed = len(self.procedure_data) - len(keep)
+        if not removed:
+            self._rebuild_stale_index()
+            return 0
+            
+        vectors = self._exact_vectors()[keep]
+        self.procedure_data = [self.procedure_data[i] for i in keep]
+        self._positions = {proc["id"]: i for i, proc in enumerate(self.procedure_data)}
+        self._fingerprints = {
+            procedure_id: fingerprint for procedure_id, fingerprint in self._fingerprints.items()
+            if procedure_id in self._positions
+        }
+        self._vectors = [vectors]
+        self._component_mask = self._component_mask[keep]
+        self.generation += 1
+        self.index = self._build_index(vectors) if keep else None
+        self._index_stale = False
+        
+        logger.info(f"Removed {removed} procedures from index")
+        return removed
+    
+    def _index_class_for(self, n: int) -> type:
+        """Return the FAISS index class used for a corpus of n procedures."""
+        import faiss
+        
+        if n >= HNSW_MIN_PROCEDURES:
+            return faiss.IndexHNSWSQ
+        if n >= SQ_MIN_PROCEDURES:
+            return faiss.IndexScalarQuantizer
+        return faiss.IndexFlatIP
+    
+    def _build_index(self, embeddings: np.ndarray) -> "faiss.Index":
+        """
+        Build an inner-product index over normalized embeddings.
+        
+        Inner product on normalized vectors ranks by cosine similarity.
+        """
+        import faiss
+        
+        index_class = self._index_class_for(len(embeddings))
+        if index_class is faiss.IndexHNSWSQ:
+            index = faiss.IndexHNSWSQ(
+                self.embedding_dim,
+                faiss.ScalarQuantizer.QT_8bit,
+                HNSW_M,
+                faiss.METRIC_INNER_PRODUCT
+            )
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+            index.train(embeddings)
+        elif index_class is faiss.IndexScalarQuantizer:
+            index = faiss.IndexScalarQuantizer(
+                self.embedding_dim,
+                faiss.ScalarQuantizer.QT_8bit,
+                faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(embeddings)
         else:
-            faiss.normalize_L2(embedding.reshape(1, -1))
-            self.index.add(embedding.reshape(1, -1))
+            index = faiss.IndexFlatIP(self.embedding_dim)
+        index.add(embeddings)
+        
+        logger.info(f"Built {index_class.__name__} index for {index.ntotal} procedures")
+        return index
+    
+    def _stored_vectors(self) -> Optional[np.ndarray]:
+        """Return the exact indexed vectors if all of them are held in memory, else None."""
+        if not self._vectors:
+            return None
+        # A stale index lags behind the exact vectors, which then hold every procedure
+        if not self._index_stale and sum(len(batch) for batch in self._vectors) != self.index.ntotal:
+            return None
+        if len(self._vectors) > 1:
+            self._vectors = [np.concatenate(self._vectors)]
+        return self._vectors[0]
+    
+    def _exact_vectors(self) -> np.ndarray:
+        """Return all indexed vectors, exact when they were added in this session."""
+        vectors = self._stored_vectors()
+        if vectors is not None:
+            return vectors
+        return self.index.reconstruct_n(0, self.index.ntotal)
+    
+    def flush(self) -> None:
+        """Encode and index any procedures staged by add_procedure, and bring the index up to date."""
+        self._encode_pending()
+        self._rebuild_stale_index()
+    
+    def _encode_pending(self) -> None:
+        """Encode the procedures staged by add_procedure without rebuilding a stale index."""
+        if self._pending:
+            pending, self._pending = self._pending, []
+            self.add_procedures_bulk(pending)
+    
+    def _rebuild_stale_index(self) -> None:
+        """Rebuild the FAISS index from the exact vectors if procedures were replaced since the last build."""
+        if self._index_stale:
+            self.index = self._build_index(self._exact_vectors())
+            self._index_stale = False
+    
+    def _materialize_table(self) -> None:
+        """Convert procedures loaded from disk into the in-memory list so they can be modified."""
+        if self._table is not None:
+            self.procedure_data = [self._get_procedure(i) for i in range(self._table.num_rows)]
+            self._table = None
+    
+    def _procedure_count(self) -> int:
+        """Return the number of stored procedures."""
+        if self._table is not None:
+            return self._table.num_rows
+        return len(self.procedure_data)
+    
+    def _get_procedure(self, idx: int) -> Dict[str, Any]:
+        """Return a copy of the stored data for the procedure at position idx."""
+        if self._table is None:
+            return self.procedure_data[idx].copy()
             
-        logger.info(f"Added procedure {procedure_name} to index")
+        # Only the requested row is converted to Python objects
+        return {
+            "id": self._table.column("id")[idx].as_py(),
+            "name": self._table.column("name")[idx].as_py(),
+            "text": self._table.column("text")[idx].as_py(),
+            "metadata": _loads_json(self._table.column("metadata_json")[idx].as_py())
+        }
     
-    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+    def component_ids(self, component_type: str) -> np.ndarray:
+        """
+        Return the index ids of the procedures that use a UI component type.
+        
+        Args:
+            component_type: Type of UI component (modal_text, modal_input, modal_button, toast)
+            
+        Returns:
+            Sorted int64 array of ids, suitable for search(ids=...)
+        """
+        self.flush()
+        
+        # One vectorized test over the component masks instead of reading metadata
+        bit = COMPONENT_BITS.get(component_type, 0)
+        return np.flatnonzero(self._component_mask & bit).astype("int64")
+    
+    def _search_params(self, ids: np.ndarray) -> "faiss.SearchParameters":
+        """Return FAISS search parameters that restrict a search to the given ids."""
+        import faiss
+        
+        # A bitmap makes each membership test O(1) during the index traversal
+        mask = np.zeros(self.index.ntotal, dtype=bool)
+        mask[ids] = True
+        bitmap = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+        
+        if isinstance(self.index, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=self.index.hnsw.efSearch)
+        else:
+            params = faiss.SearchParameters(sel=selector)
+        # The selector only points at the bitmap, so it has to outlive the search
+        params.bitmap = bitmap
+        return params
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        Generate the embedding used to search for a query.
+        
+        Args:
+            query: Query text
+            
+        Returns:
+            float32 numpy array containing the L2-normalized embedding
+        """
+        return self.generate_embedding(query).astype("float32")
+    
+    def search(self, query: str, k: int = 5, ids: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
         """
         Search for similar procedures.
         
         Args:
             query: Query text
             k: Number of results to return
+            ids: If given, only the procedures with these index ids are searched
             
         Returns:
             List of dictionaries containing similar procedures
         """
-        if self.index is None or len(self.procedure_data) == 0:
-            logger.warning("No procedures in index")
-            return []
+        return self.search_vec(self.embed_query(query), k, ids)
+    
+    def search_vec(self, query_embedding: np.ndarray, k: int = 5, ids: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """
+        Search for the procedures most similar to an embedded query.
+        
+        Args:
+            query_embedding: Query embedding from embed_query
+            k: Number of results to return
+            ids: If given, only the procedures with these index ids are searched
+            
+        Returns:
+            List of dictionaries containing similar procedures
+        """
+        return self.search_batch_vec(query_embedding.reshape(1, -1), k, ids)[0]
+    
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Generate the embeddings used to search for several queries in one model call.
+        
+        Args:
+            queries: Query texts
+            
+        Returns:
+            float32 numpy array of shape (len(queries), embedding_dim)
+        """
+        return self.generate_embeddings(queries)
+    
+    def search_batch_vec(self, query_embeddings: np.ndarray, k: int = 5,
+                         ids: Optional[np.ndarray] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Search for the procedures most similar to each of several embedded queries at once.
+        
+        Args:
+            query_embeddings: Query embeddings from embed_queries, one per row
+            k: Number of results to return per query
+            ids: If given, only the procedures with these index ids are searched
             
-        # Generate query embedding
-        query_embedding = self.generate_embedding(query)
-        faiss.normalize_L2(query_embedding.reshape(1, -1))
+        Returns:
+            List with the similar procedures for each query, in query order
+        """
+        import faiss
+        
+        self.flush()
         
+        count = self._procedure_count()
+        if self.index is None or count == 0:
+            logger.warning("No procedures in index")
+            return [[] for _ in range(len(query_embeddings))]
+            
+        limit = min(k, count)
+        params = None
+        if ids is not None:
+            if len(ids) == 0:
+                return [[] for _ in range(len(query_embeddings))]
+            limit = min(limit, len(ids))
+            params = self._search_params(ids)
+            
+        # Unfiltered searches go to an exact copy of the index on the GPU when there is one
+        index = self.index
+        gpu_index = self._gpu_search_index() if ids is None else None
+        if gpu_index is not None:
+            index = gpu_index
+            
+        # Quantized scores are approximate, so fetch a few extra candidates and
+        # rescore them exactly when the full-precision vectors are available
+        vectors = None
+        fetch = limit
+        if gpu_index is None and not isinstance(index, faiss.IndexFlat):
+            vectors = self._stored_vectors()
+            if vectors is not None:
+                fetch = min(math.ceil(limit * RERANK_OVERFETCH), count if ids is None else len(ids))
+                
         # Search index
-        distances, indices = self.index.search(query_embedding.reshape(1, -1), min(k, len(self.procedure_data)))
+        scores, indices = index.search(query_embeddings, fetch, params=params)
         
-        # Return results
         results = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(self.procedure_data):
-                result = self.procedure_data[idx].copy()
-                result["distance"] = float(distances[0][i])
-                results.append(result)
+        for query_embedding, query_scores, query_indices in zip(query_embeddings, scores, indices):
+            if vectors is not None:
+                candidates = query_indices[query_indices >= 0]
+                exact_scores = vectors[candidates] @ query_embedding
+                order = np.argsort(-exact_scores, kind="stable")[:limit]
+                query_indices = candidates[order]
+                query_scores = exact_scores[order]
                 
+            # Results are ranked by descending score (cosine similarity);
+            # distance stays the squared L2 distance between unit vectors
+            query_results = []
+            for score, idx in zip(query_scores, query_indices):
+                if 0 <= idx < count:
+                    result = self._get_procedure(idx)
+                    result["score"] = float(score)
+                    result["distance"] = 2.0 - 2.0 * result["score"]
+                    query_results.append(result)
+            results.append(query_results)
+            
         return results
     
+    def search_parallel(self, query_embedding: np.ndarray, k: int = 5,
+                        n_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Exactly search for the procedures most similar to an embedded query on several threads.
+        
+        The exact vectors are split into row chunks; each worker scores its chunk
+        with one matrix-vector product (which releases the GIL) and keeps its top k,
+        then the candidates are merged.
+        
+        Args:
+            query_embedding: Query embedding from embed_query
+            k: Number of results to return
+            n_workers: Number of threads to use; defaults to the number of CPUs
+            
+        Returns:
+            List of dictionaries containing similar procedures
+        """
+        self.flush()
+        
+        if self.index is None or self._procedure_count() == 0:
+            logger.warning("No procedures in index")
+            return []
+            
+        matrix = self._exact_vectors()
+        k = min(k, len(matrix))
+        n_chunks = max(1, min(n_workers or os.cpu_count() or 1, len(matrix) // PARALLEL_MIN_ROWS))
+        bounds = np.linspace(0, len(matrix), n_chunks + 1, dtype="int64")
+        
+        def top_k(start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+            scores = matrix[start:stop] @ query_embedding
+            if len(scores) > k:
+                rows = np.argpartition(-scores, k - 1)[:k]
+            else:
+                rows = np.arange(len(scores))
+            return rows + start, scores[rows]
+            
+        if n_chunks == 1:
+            parts = [top_k(0, len(matrix))]
+        else:
+            with ThreadPoolExecutor(max_workers=n_chunks) as pool:
+                parts = list(pool.map(top_k, bounds[:-1], bounds[1:]))
+                
+        indices = np.concatenate([rows for rows, _ in parts])
+        scores = np.concatenate([chunk_scores for _, chunk_scores in parts])
+        order = np.argsort(-scores, kind="stable")[:k]
+        
+        results = []
+        for idx, score in zip(indices[order], scores[order]):
+            result = self._get_procedure(idx)
+            result["score"] = float(score)
+            result["distance"] = 2.0 - 2.0 * result["score"]
+            results.append(result)
+            
+        return results
+    
+    def _gpu_search_index(self) -> Optional["faiss.Index"]:
+        """
+        Return an exact inner-product copy of the index on the first GPU.
+        
+        Returns None when FAISS was built without GPU support or no GPU is present.
+        Brute force on a GPU outruns the CPU graph index, and exact scores need no rerank.
+        """
+        import faiss
+        
+        if self._gpu_available is None:
+            self._gpu_available = hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0
+        if not self._gpu_available:
+            return None
+            
+        if self._gpu_index is None or self._gpu_generation != self.generation:
+            cpu_index = faiss.IndexFlatIP(self.embedding_dim)
+            cpu_index.add(self._exact_vectors())
+            if self._gpu_resources is None:
+                self._gpu_resources = faiss.StandardGpuResources()
+            self._gpu_index = faiss.index_cpu_to_gpu(self._gpu_resources, 0, cpu_index)
+            self._gpu_generation = self.generation
+            
+        return self._gpu_index
+    
     def save(self, directory: str) -> bool:
         """
         Save the index and procedure data to disk.
@@ -113,6 +722,11 @@ class ProcedureEmbeddings:
         Returns:
             True if successful, False otherwise
         """
+        import faiss
+        import pyarrow as pa
+        
+        self.flush()
+        
         if self.index is None:
             logger.warning("No index to save")
             return False
@@ -120,12 +734,51 @@ class ProcedureEmbeddings:
         try:
             os.makedirs(directory, exist_ok=True)
             
+            # Files are written next to their destination and swapped in, so data that
+            # is still memory-mapped from a previous load is never truncated while in use
+            index_path = os.path.join(directory, "procedures.index")
+            data_path = os.path.join(directory, "procedures.arrow")
+            vectors_path = os.path.join(directory, "procedures.npy")
+            
             # Save index
-            faiss.write_index(self.index, os.path.join(directory, "procedures.index"))
+            faiss.write_index(self.index, index_path + ".tmp")
             
-            # Save procedure data
-            with open(os.path.join(directory, "procedures.pkl"), "wb") as f:
-                pickle.dump(self.procedure_data, f)
+            # Save the exact vectors used for reranking and rebuilds, if they're known
+            vectors = self._stored_vectors()
+            if vectors is not None:
+                with open(vectors_path + ".tmp", "wb") as f:
+                    np.save(f, vectors)
+            
+            # Save procedure data as an Arrow IPC file so it can be memory-mapped on load
+            if self._table is not None:
+                table = self._table
+                if "component_mask" not in table.column_names:
+                    table = table.append_column("component_mask", pa.array(self._component_mask, type=pa.uint8()))
+            else:
+                table = pa.table({
+                    "id": [proc["id"] for proc in self.procedure_data],
+                    "name": [proc["name"] for proc in self.procedure_data],
+                    "text": [proc["text"] for proc in self.procedure_data],
+                    "metadata_json": pa.array(
+                        [_dumps_json(proc["metadata"]) for proc in self.procedure_data],
+                        type=pa.string()
+                    ),
+                    "fingerprint": pa.array(
+                        [self._fingerprints.get(proc["id"], b"") for proc in self.procedure_data],
+                        type=pa.binary()
+                    ),
+                    "component_mask": pa.array(self._component_mask, type=pa.uint8())
+                })
+            with pa.OSFile(data_path + ".tmp", "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+                    
+            os.replace(index_path + ".tmp", index_path)
+            os.replace(data_path + ".tmp", data_path)
+            if vectors is not None:
+                os.replace(vectors_path + ".tmp", vectors_path)
+            elif os.path.exists(vectors_path):
+                os.remove(vectors_path)
                 
             logger.info(f"Saved index and procedure data to {directory}")
             return True
@@ -134,35 +787,108 @@ class ProcedureEmbeddings:
             logger.error(f"Error saving index: {str(e)}")
             return False
     
-    def load(self, directory: str) -> bool:
+    def load(self, directory: str, mmap: bool = True) -> bool:
         """
         Load the index and procedure data from disk.
         
         Args:
             directory: Directory to load from
+            mmap: If True, memory-map the index, vectors and procedure data read-only
+                so loading doesn't read them up front; pass False to read everything
+                into memory, e.g. to modify the index or save it back to the same
+                directory (a mapped file can't be replaced on Windows)
             
         Returns:
             True if successful, False otherwise
         """
+        import faiss
+        import pyarrow as pa
+        
+        # Everything is read into locals and only assigned once the whole load has
+        # succeeded, so a failed load leaves the current state untouched
         try:
             # Load index
             index_path = os.path.join(directory, "procedures.index")
-            if os.path.exists(index_path):
-                self.index = faiss.read_index(index_path)
-            else:
+            if not os.path.exists(index_path):
                 logger.warning(f"Index file not found: {index_path}")
                 return False
                 
-            # Load procedure data
-            data_path = os.path.join(directory, "procedures.pkl")
+            if mmap:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            else:
+                index = faiss.read_index(index_path)
+                
+            # Exact vectors are paged in on demand as well
+            stored_vectors = []
+            vectors_path = os.path.join(directory, "procedures.npy")
+            if os.path.exists(vectors_path):
+                vectors = np.load(vectors_path, mmap_mode="r" if mmap else None)
+                if len(vectors) == index.ntotal:
+                    stored_vectors = [vectors]
+                    
+            if index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                # Indexes saved before the switch to cosine similarity use L2; rebuild
+                # them as inner-product indexes over the normalized vectors
+                vectors = np.ascontiguousarray(index.reconstruct_n(0, index.ntotal), dtype="float32")
+                faiss.normalize_L2(vectors)
+                stored_vectors = [vectors]
+                index = self._build_index(vectors)
+                
+            if isinstance(index, faiss.IndexHNSW):
+                index.hnsw.efSearch = HNSW_EF_SEARCH
+                
+            # Load procedure data; when mapped, rows are read from the file on demand
+            data_path = os.path.join(directory, "procedures.arrow")
+            legacy_data_path = os.path.join(directory, "procedures.pkl")
             if os.path.exists(data_path):
-                with open(data_path, "rb") as f:
-                    self.procedure_data = pickle.load(f)
+                if mmap:
+                    table = pa.ipc.open_file(pa.memory_map(data_path, "r")).read_all()
+                else:
+                    with pa.OSFile(data_path, "rb") as source:
+                        table = pa.ipc.open_file(source).read_all()
+                procedure_data = []
+                ids = table.column("id").to_pylist()
+                if "fingerprint" in table.column_names:
+                    fingerprints = table.column("fingerprint").to_pylist()
+                else:
+                    fingerprints = [b""] * len(ids)
+                if "component_mask" in table.column_names:
+                    masks = table.column("component_mask").to_numpy()
+                else:
+                    masks = [
+                        _component_mask(_loads_json(value))
+                        for value in table.column("metadata_json").to_pylist()
+                    ]
+            elif os.path.exists(legacy_data_path):
+                with open(legacy_data_path, "rb") as f:
+                    procedure_data = pickle.load(f)
+                table = None
+                ids = [proc["id"] for proc in procedure_data]
+                fingerprints = [_fingerprint(proc["text"]) for proc in procedure_data]
+                masks = [_component_mask(proc["metadata"]) for proc in procedure_data]
             else:
                 logger.warning(f"Procedure data file not found: {data_path}")
                 return False
                 
-            logger.info(f"Loaded index with {len(self.procedure_data)} procedures from {directory}")
+            if len(ids) != index.ntotal:
+                logger.warning(f"Index has {index.ntotal} vectors but {len(ids)} procedures in {directory}")
+                return False
+                
+            self.index = index
+            self._vectors = stored_vectors
+            self._table = table
+            self.procedure_data = procedure_data
+            self._pending = []
+            self._index_stale = False
+            self._positions = {procedure_id: i for i, procedure_id in enumerate(ids)}
+            self._fingerprints = {
+                procedure_id: fingerprint for procedure_id, fingerprint in zip(ids, fingerprints)
+                if fingerprint
+            }
+            self._component_mask = np.array(masks, dtype=np.uint8)
+            self.generation += 1
+                
+            logger.info(f"Loaded index with {self._procedure_count()} procedures from {directory}")
             return True
             
         except Exception as e:
@@ -1,70 +1,222 @@
-from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from itertools import islice
+import math
+from typing import List, Dict, Any, Optional, Tuple
 import logging
+import numpy as np
 from .embeddings import ProcedureEmbeddings
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# A query whose embedding is at least this similar to a cached query reuses its results
+SEMANTIC_CACHE_THRESHOLD = 0.97
+
+def _normalize_query(query: str) -> str:
+    """Return the form of a query used as the exact-match cache key."""
+    return " ".join(query.lower().split())
+
 class ProcedureRetriever:
     """
     Retrieve relevant stored procedures based on user queries.
     """
     
-    def __init__(self, embeddings: ProcedureEmbeddings):
+    def __init__(self, embeddings: ProcedureEmbeddings, cache_size: int = 256):
         """
         Initialize the procedure retriever.
         
         Args:
             embeddings: ProcedureEmbeddings instance
+            cache_size: Maximum number of queries whose results are cached
         """
         self.embeddings = embeddings
+        self.cache_size = cache_size
+        self._clear_cache()
+    
+    def _clear_cache(self) -> None:
+        """Drop all cached query results."""
+        # Exact cache: normalized query -> (k, results), in least recently used order
+        self._exact = OrderedDict()
+        # Semantic cache: embeddings of cached queries, with their k and results by row
+        self._qcache_index = None
+        self._qcache_results = []
+        self._cache_generation = self.embeddings.generation
+    
+    def _cached_results(self, key: str, query_embedding=None) -> Optional[Tuple[int, List[Dict[str, Any]]]]:
+        """Return the cached (k, results) for a query, or None on a miss."""
+        # Index staged procedures first so they invalidate the cache
+        self.embeddings.flush()
+        if self._cache_generation != self.embeddings.generation:
+            self._clear_cache()
+            
+        if query_embedding is None:
+            cached = self._exact.get(key)
+            if cached is not None:
+                self._exact.move_to_end(key)
+            return cached
+            
+        if self._qcache_index is None or self._qcache_index.ntotal == 0:
+            return None
+        scores, rows = self._qcache_index.search(query_embedding.reshape(1, -1), 1)
+        if scores[0][0] >= SEMANTIC_CACHE_THRESHOLD:
+            return self._qcache_results[rows[0][0]]
+        return None
     
-    def retrieve(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+    def _cache_results(self, key: str, query_embedding, k: int, results: List[Dict[str, Any]]) -> None:
+        """Cache the results of a query under its normalized text and its embedding."""
+        import faiss
+        
+        self._exact[key] = (k, results)
+        if len(self._exact) > self.cache_size:
+            self._exact.popitem(last=False)
+            
+        if self._qcache_index is None or self._qcache_index.ntotal >= self.cache_size:
+            self._qcache_index = faiss.IndexFlatIP(self.embeddings.embedding_dim)
+            self._qcache_results = []
+        self._qcache_index.add(query_embedding.reshape(1, -1))
+        self._qcache_results.append((k, results))
+    
+    def retrieve(self, query: str, k: int = 5, query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
         """
         Retrieve relevant procedures for a query.
         
         Args:
             query: User query
             k: Number of results to return
+            query_embedding: Embedding of the query from embeddings.embed_query, if
+                already computed
             
         Returns:
             List of dictionaries containing relevant procedures
         """
+        # Identical queries skip embedding, and paraphrases skip the index search
+        key = _normalize_query(query)
+        cached = self._cached_results(key)
+        if cached is None or cached[0] < k:
+            if query_embedding is None:
+                query_embedding = self.embeddings.embed_query(query)
+            cached = self._cached_results(key, query_embedding)
+            
+        if cached is not None and cached[0] >= k:
+            results = [result.copy() for result in cached[1][:k]]
+            logger.info("Retrieved %d cached procedures for query: %s", len(results), query)
+            return results
+            
         # Search for similar procedures
-        results = self.embeddings.search(query, k)
+        results = self.embeddings.search_vec(query_embedding, k)
+        self._cache_results(key, query_embedding, k, [result.copy() for result in results])
+        
+        # Log results; %-style arguments are only formatted if the record is emitted
+        logger.info("Retrieved %d procedures for query: %s", len(results), query)
         
+        return results
+    
+    def retrieve_batch(self, queries: List[str], k: int = 5) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieve relevant procedures for several queries at once.
+        
+        Queries that aren't cached are embedded in one model call and searched in
+        one index call.
+        
+        Args:
+            queries: User queries
+            k: Number of results to return per query
+            
+        Returns:
+            List with the relevant procedures for each query, in query order
+        """
+        keys = [_normalize_query(query) for query in queries]
+        results = [None] * len(queries)
+        misses = []
+        for i, key in enumerate(keys):
+            cached = self._cached_results(key)
+            if cached is not None and cached[0] >= k:
+                results[i] = [result.copy() for result in cached[1][:k]]
+            else:
+                misses.append(i)
+                
+        if misses:
+            query_embeddings = self.embeddings.embed_queries([queries[i] for i in misses])
+            searched = self.embeddings.search_batch_vec(query_embeddings, k)
+            for i, query_embedding, query_results in zip(misses, query_embeddings, searched):
+                results[i] = query_results
+                self._cache_results(keys[i], query_embedding, k, [result.copy() for result in query_results])
+                
         # Log results
-        logger.info(f"Retrieved {len(results)} procedures for query: {query}")
+        logger.info("Retrieved procedures for %d queries (%d searched)", len(queries), len(misses))
         
         return results
     
-    def retrieve_with_filter(self, query: str, filter_func, k: int = 5) -> List[Dict[str, Any]]:
+    def retrieve_parallel(self, query: str, k: int = 5, n_workers: Optional[int] = None,
+                          query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
         """
-        Retrieve relevant procedures with a filter function.
+        Retrieve relevant procedures with an exact search split across threads.
         
         Args:
             query: User query
-            filter_func: Function that takes a procedure and returns True if it should be included
             k: Number of results to return
+            n_workers: Number of threads to use; defaults to the number of CPUs
+            query_embedding: Embedding of the query from embeddings.embed_query, if
+                already computed
             
         Returns:
             List of dictionaries containing relevant procedures
         """
+        if query_embedding is None:
+            query_embedding = self.embeddings.embed_query(query)
+            
         # Search for similar procedures
-        all_results = self.embeddings.search(query, k * 2)  # Get more results to account for filtering
+        results = self.embeddings.search_parallel(query_embedding, k, n_workers)
         
-        # Apply filter
-        filtered_results = [result for result in all_results if filter_func(result)]
+        # Log results
+        logger.info("Retrieved %d procedures for query: %s (parallel scan)", len(results), query)
         
-        # Limit to k results
-        results = filtered_results[:k]
+        return results
+    
+    def retrieve_with_filter(self, query: str, filter_func, k: int = 5,
+                             query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """
+        Retrieve relevant procedures with a filter function.
         
+        Args:
+            query: User query
+            filter_func: Function that takes a procedure and returns True if it should be included
+            k: Number of results to return
+            query_embedding: Embedding of the query from embeddings.embed_query, if
+                already computed
+            
+        Returns:
+            List of dictionaries containing relevant procedures
+        """
+        if query_embedding is None:
+            query_embedding = self.embeddings.embed_query(query)
+            
+        # filter_func runs at most once per procedure, even when the search is repeated
+        verdicts = {}
+        def matches(result):
+            if result["id"] not in verdicts:
+                verdicts[result["id"]] = filter_func(result)
+            return verdicts[result["id"]]
+            
+        # Start with twice as many results as needed; if fewer than k pass the filter,
+        # search again for as many as the observed match rate suggests are needed
+        fetch = k * 2
+        while True:
+            all_results = self.embeddings.search_vec(query_embedding, fetch)
+            
+            # Stop filtering as soon as k results have passed
+            results = list(islice((result for result in all_results if matches(result)), k))
+            if len(results) >= k or len(all_results) < fetch:
+                break
+            fetch = max(fetch * 2, math.ceil(k * len(all_results) / max(len(results), 1)))
+            
         # Log results
-        logger.info(f"Retrieved {len(results)} procedures for query: {query} (after filtering)")
+        logger.info("Retrieved %d procedures for query: %s (after filtering)", len(results), query)
         
         return results
     
-    def retrieve_ui_components(self, query: str, component_type: Optional[str] = None, k: int = 5) -> List[Dict[str, Any]]:
+    def retrieve_ui_components(self, query: str, component_type: Optional[str] = None, k: int = 5,
+                               query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
         """
         Retrieve procedures with specific UI components.
         
@@ -72,19 +224,24 @@ class ProcedureRetriever:
             query: User query
             component_type: Type of UI component to filter for (modal_text, modal_input, modal_button, toast)
             k: Number of results to return
+            query_embedding: Embedding of the query from embeddings.embed_query, if
+                already computed; pass the same one to every retrieve call for a query
             
         Returns:
             List of dictionaries containing relevant procedures
         """
         if component_type:
-            # Filter for procedures with the specified component type
-            def filter_func(procedure):
-                if "metadata" in procedure and "ui_components" in procedure["metadata"]:
-                    components = procedure["metadata"]["ui_components"]
-                    return component_type in components and len(components[component_type]) > 0
-                return False
-                
-            return self.retrieve_with_filter(query, filter_func, k)
+            # Restrict the index search to procedures with the specified component type,
+            # so up to k of them come back without overfetching and filtering
+            if query_embedding is None:
+                query_embedding = self.embeddings.embed_query(query)
+            ids = self.embeddings.component_ids(component_type)
+            results = self.embeddings.search_vec(query_embedding, k, ids=ids)
+            
+            # Log results
+            logger.info("Retrieved %d procedures with %s for query: %s", len(results), component_type, query)
+            
+            return results
         else:
             # No component type filter, just retrieve based on query
-            return self.retrieve(query, k)
+            return self.retrieve(query, k, query_embedding=query_embedding)
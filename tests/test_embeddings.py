@@ -0,0 +1,92 @@
+import hashlib
+import sys
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+from rag import embeddings
+from rag.embeddings import ProcedureEmbeddings
+
+class _HashModel:
+    """Deterministic stand-in for a sentence-transformers model."""
+    
+    dim = 16
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+        
+    def encode(self, texts, **kwargs):
+        vectors = []
+        for text in [texts] if isinstance(texts, str) else texts:
+            seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype("float32")
+            vectors.append(vector / np.linalg.norm(vector))
+        return vectors[0] if isinstance(texts, str) else np.array(vectors)
+
+def _procedure(procedure_id: str, text: str, components=()):
+    """Return a procedure item using the given UI component types."""
+    return {
+        "id": procedure_id,
+        "name": procedure_id,
+        "text": text,
+        "metadata": {"ui_components": {name: [{}] for name in components}}
+    }
+
+@unittest.skipIf(faiss is None, "faiss is not installed")
+class ProcedureEmbeddingsTest(unittest.TestCase):
+    
+    def setUp(self):
+        # torch is only needed to pick a device here, and encoding goes to the stand-in model
+        model = _HashModel()
+        torch = types.SimpleNamespace(cuda=types.SimpleNamespace(is_available=lambda: False))
+        with mock.patch.dict(sys.modules, {"torch": torch}), \
+                mock.patch.object(embeddings, "_get_model", return_value=model):
+            self.embeddings = ProcedureEmbeddings()
+        self.embeddings.generate_embedding = model.encode
+        self.embeddings.generate_embeddings = model.encode
+        
+    def test_repeated_id_in_one_batch(self):
+        self.embeddings.add_procedure("a", "a", "t1", {})
+        self.embeddings.add_procedure("a", "a", "t2", {})
+        self.embeddings.flush()
+        
+        self.assertEqual(self.embeddings.index.ntotal, 1)
+        self.assertEqual(self.embeddings._get_procedure(0)["text"], "t2")
+        
+    def test_repeated_id_in_bulk_keeps_last_components(self):
+        self.embeddings.add_procedures_bulk([
+            _procedure("a", "t1", ["toast"]),
+            _procedure("b", "t2"),
+            _procedure("a", "t3", ["modal_text"]),
+        ])
+        self.embeddings.flush()
+        
+        self.assertEqual(self.embeddings.index.ntotal, 2)
+        self.assertEqual(list(self.embeddings.component_ids("modal_text")), [0])
+        self.assertEqual(list(self.embeddings.component_ids("toast")), [])
+        self.assertEqual(self.embeddings.search("t3", k=1)[0]["id"], "a")
+        
+    def test_replaced_procedures_rebuild_index_once(self):
+        self.embeddings.batch_size = 4
+        items = [_procedure(f"p{i}", f"text {i}") for i in range(20)]
+        self.embeddings.add_procedures_stream(iter(items))
+        
+        edited = [dict(item, text=item["text"] + " edited") if i % 4 == 0 else item for i, item in enumerate(items)]
+        with mock.patch.object(self.embeddings, "_build_index", wraps=self.embeddings._build_index) as build:
+            self.embeddings.add_procedures_stream(iter(edited))
+            self.embeddings.retain_procedures([item["id"] for item in edited])
+            self.embeddings.flush()
+            
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(self.embeddings.index.ntotal, 20)
+        self.assertEqual(self.embeddings.search("text 8 edited", k=1)[0]["id"], "p8")
+
+if __name__ == "__main__":
+    unittest.main()
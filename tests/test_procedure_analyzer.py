@@ -0,0 +1,30 @@
+import unittest
+
+from analyzer.procedure_analyzer import StoredProcedureAnalyzer
+
+class ControlFlowTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.analyzer = StoredProcedureAnalyzer()
+        
+    def test_single_statement_if_followed_by_else_block(self):
+        blocks = self.analyzer._extract_control_flow("IF @a=1 SET @b=1\nELSE BEGIN SELECT 2 END")
+        
+        self.assertEqual(blocks, [])
+        
+    def test_else_if_blocks(self):
+        blocks = self.analyzer._extract_control_flow(
+            "IF @a=1 BEGIN SELECT 1 END ELSE IF @a=2 BEGIN SELECT 2 END ELSE BEGIN SELECT 3 END"
+        )
+        
+        self.assertEqual([(block["type"], block["condition"]) for block in blocks], [("if", "@a=1"), ("if", "@a=2")])
+        
+    def test_if_without_semicolon_is_not_attached_to_try(self):
+        blocks = self.analyzer._extract_control_flow(
+            "IF @a=1 SET @b=1\nBEGIN TRY SELECT 1 END TRY BEGIN CATCH SELECT 2 END CATCH"
+        )
+        
+        self.assertEqual(blocks, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,18 +1,33 @@
 import argparse
+import functools
 import logging
 import os
 import sys
-from typing import Dict, Any, List, Optional
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Callable
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+# Resolved once; the config paths are used on every invocation
+_ROOT_DIR = Path(__file__).resolve().parent.parent
+_CONFIG_DIR = _ROOT_DIR / "config"
+_CONFIG_FILE = _CONFIG_DIR / "config.json"
+
 # Add parent directory to path
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(str(_ROOT_DIR))
 
-from database.connector import SQLServerConnector
-from analyzer.procedure_analyzer import StoredProcedureAnalyzer
-from rag.embeddings import ProcedureEmbeddings
-from rag.retriever import ProcedureRetriever
-from generator.code_generator import TSQLCodeGenerator
+# The database, embedding (torch) and OpenAI modules are imported when a command
+# first uses them, so --help, argument errors and setup don't pay for them
+from utils.pipeline import prefetch
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,6 +35,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=1)
+def _read_config_file() -> Dict[str, Any]:
+    """
+    Read and parse the config file once per process.
+    
+    Returns:
+        Settings from the config file, or an empty dict if there is none
+    """
+    try:
+        data = _CONFIG_FILE.read_bytes()
+    except FileNotFoundError:
+        return {}
+    return orjson.loads(data) if orjson else json.loads(data)
+
 class TSQLCLI:
     """
     Command-line interface for the T-SQL RAG agent.
@@ -28,11 +57,13 @@ class TSQLCLI:
     def __init__(self):
         """Initialize the CLI."""
         self.config = self._load_config()
-        self.db_connector = None
-        self.analyzer = StoredProcedureAnalyzer()
-        self.embeddings = ProcedureEmbeddings()
-        self.retriever = None
-        self.generator = None
+        self._index_dir = Path(self.config["data_dir"]) / "index"
+        self._set_up = False
+        self._db_connector = None
+        self._analyzer = None
+        self._embeddings = None
+        self._retriever = None
+        self._generator = None
         
     def _load_config(self) -> Dict[str, Any]:
         """Load configuration from file or environment variables."""
@@ -44,50 +75,105 @@ class TSQLCLI:
         }
         
         # Try to load from config file
-        config_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "config.json")
-        if os.path.exists(config_file):
-            try:
-                with open(config_file, "r") as f:
-                    file_config = json.load(f)
-                    config.update(file_config)
-            except Exception as e:
-                logger.warning(f"Error loading config file: {str(e)}")
-                
+        try:
+            config.update(_read_config_file())
+        except Exception as e:
+            logger.warning(f"Error loading config file: {str(e)}")
+            
         return config
     
     def _save_config(self) -> bool:
         """Save configuration to file."""
-        config_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config")
-        os.makedirs(config_dir, exist_ok=True)
+        _CONFIG_DIR.mkdir(parents=True, exist_ok=True)
         
-        config_file = os.path.join(config_dir, "config.json")
         try:
-            with open(config_file, "w") as f:
-                json.dump(self.config, f, indent=2)
+            if orjson:
+                data = orjson.dumps(self.config, option=orjson.OPT_INDENT_2)
+            else:
+                data = json.dumps(self.config, indent=2).encode("utf-8")
+            _CONFIG_FILE.write_bytes(data)
+            _read_config_file.cache_clear()
             return True
         except Exception as e:
             logger.error(f"Error saving config file: {str(e)}")
             return False
     
     def setup(self) -> bool:
-        """Set up the CLI components."""
-        # Create data directory
-        os.makedirs(self.config["data_dir"], exist_ok=True)
-        
-        # Initialize database connector
-        self.db_connector = SQLServerConnector(
-            server=self.config["server"],
-            database=self.config["database"]
-        )
-        
-        # Initialize retriever
-        self.retriever = ProcedureRetriever(self.embeddings)
+        """
+        Set up the CLI components.
         
-        # Initialize generator
-        self.generator = TSQLCodeGenerator(api_key=self.config["openai_api_key"])
+        Components are created on first use, so each command only imports and
+        builds what it needs; the setup command itself loads no model or client.
+        """
+        # Create data directory
+        Path(self.config["data_dir"]).mkdir(parents=True, exist_ok=True)
         
+        self._set_up = True
         return True
     
+    @property
+    def db_connector(self):
+        """Database connector, created on first use after setup."""
+        if self._db_connector is None and self._set_up:
+            from database.connector import SQLServerConnector
+            self._db_connector = SQLServerConnector(
+                server=self.config["server"],
+                database=self.config["database"]
+            )
+        return self._db_connector
+    
+    @db_connector.setter
+    def db_connector(self, value):
+        self._db_connector = value
+    
+    @property
+    def analyzer(self):
+        """Procedure analyzer, created on first use after setup."""
+        if self._analyzer is None and self._set_up:
+            from analyzer.procedure_analyzer import StoredProcedureAnalyzer
+            self._analyzer = StoredProcedureAnalyzer()
+        return self._analyzer
+    
+    @analyzer.setter
+    def analyzer(self, value):
+        self._analyzer = value
+    
+    @property
+    def embeddings(self):
+        """Procedure embeddings, created on first use after setup."""
+        if self._embeddings is None and self._set_up:
+            from rag.embeddings import ProcedureEmbeddings
+            self._embeddings = ProcedureEmbeddings()
+        return self._embeddings
+    
+    @embeddings.setter
+    def embeddings(self, value):
+        self._embeddings = value
+    
+    @property
+    def retriever(self):
+        """Retriever over the embeddings, created on first use after setup."""
+        if self._retriever is None and self._set_up:
+            from rag.retriever import ProcedureRetriever
+            self._retriever = ProcedureRetriever(self.embeddings)
+        return self._retriever
+    
+    @retriever.setter
+    def retriever(self, value):
+        self._retriever = value
+    
+    @property
+    def generator(self):
+        """Code generator, created on first use after setup."""
+        if self._generator is None and self._set_up:
+            from generator.code_generator import TSQLCodeGenerator
+            self._generator = TSQLCodeGenerator(api_key=self.config["openai_api_key"])
+        return self._generator
+    
+    @generator.setter
+    def generator(self, value):
+        self._generator = value
+    
     def connect_to_database(self) -> bool:
         """Connect to the database."""
         if not self.db_connector:
@@ -110,53 +196,78 @@ class TSQLCLI:
             logger.error("Database connector not initialized")
             return False
             
-        # Get procedures
-        procedures = self.db_connector.get_stored_procedures(filter_ui_only=filter_ui_only)
-        if not procedures:
-            logger.warning("No procedures found")
-            return False
+        # Reuse the embeddings of procedures that haven't changed since the last run
+        if self._index_dir.exists() and not self.embeddings.load(self._index_dir, mmap=False):
+            logger.warning("Existing index could not be loaded; rebuilding it from scratch")
             
-        logger.info(f"Indexing {len(procedures)} procedures")
+        # Stream all procedure definitions in a single query; rows are fetched on a
+        # background thread while earlier ones are analyzed and encoded
+        definitions = prefetch(self.db_connector.get_procedure_definitions(filter_ui_only=filter_ui_only))
+        if tqdm is not None and sys.stderr.isatty():
+            definitions = tqdm(definitions, desc="Indexing", unit=" procedures")
+        indexed_ids = []
+        skipped = 0
         
-        # Process each procedure
-        for proc in procedures:
-            # Get procedure definition
-            definition = self.db_connector.get_procedure_definition(
-                proc["schema_name"],
-                proc["procedure_name"]
-            )
-            
-            if not definition:
-                logger.warning(f"No definition found for {proc['schema_name']}.{proc['procedure_name']}")
-                continue
+        def analyzed_procedures():
+            nonlocal skipped
+            for proc in definitions:
+                definition = proc["definition"]
+                if not definition:
+                    # Reported once in the summary below rather than per procedure
+                    skipped += 1
+                    logger.debug("No definition found for %s.%s", proc["schema_name"], proc["procedure_name"])
+                    continue
+                    
+                # Analyze procedure
+                metadata = self.analyzer.analyze_procedure(definition)
+                
+                proc_id = f"{proc['schema_name']}.{proc['procedure_name']}"
+                indexed_ids.append(proc_id)
+                yield {
+                    "id": proc_id,
+                    "name": proc["procedure_name"],
+                    "text": definition,
+                    "metadata": metadata
+                }
                 
-            # Analyze procedure
-            metadata = self.analyzer.analyze_procedure(definition)
+        # Add to index; if the stream fails partway, the rows seen so far are not the
+        # whole catalogue, so nothing may be pruned or saved
+        try:
+            self.embeddings.add_procedures_stream(analyzed_procedures())
+        except Exception as e:
+            logger.error(f"Indexing stopped, existing index left unchanged: {str(e)}")
+            return False
             
-            # Add to index
-            proc_id = f"{proc['schema_name']}.{proc['procedure_name']}"
-            proc_name = proc["procedure_name"]
-            self.embeddings.add_procedure(proc_id, proc_name, definition, metadata)
+        if not indexed_ids:
+            logger.warning("No procedures found (skipped %d with no definition)", skipped)
+            return False
+            
+        # Drop procedures that no longer exist or no longer match the filter
+        self.embeddings.retain_procedures(indexed_ids)
             
         # Save index
-        index_dir = os.path.join(self.config["data_dir"], "index")
-        self.embeddings.save(index_dir)
-        
-        logger.info(f"Indexed {len(procedures)} procedures")
+        if not self.embeddings.save(self._index_dir):
+            return False
+            
+        logger.info("Indexed %d procedures, skipped %d with no definition", len(indexed_ids), skipped)
         return True
     
     def load_index(self) -> bool:
         """Load the procedure index from disk."""
-        index_dir = os.path.join(self.config["data_dir"], "index")
-        return self.embeddings.load(index_dir)
+        if not self.embeddings:
+            logger.error("Embeddings not initialized")
+            return False
+            
+        return self.embeddings.load(self._index_dir)
     
-    def generate_code(self, description: str, k: int = 3) -> str:
+    def generate_code(self, description: str, k: int = 3, on_token: Optional[Callable[[str], None]] = None) -> str:
         """
         Generate T-SQL code based on a description.
         
         Args:
             description: Description of what the procedure should do
             k: Number of similar procedures to use as reference
+            on_token: Optional callback invoked with each chunk of code as it is generated
             
         Returns:
             Generated T-SQL code
@@ -169,17 +280,19 @@ class TSQLCLI:
         similar_procedures = self.retriever.retrieve(description, k)
         
         # Generate code
-        code = self.generator.generate_ui_procedure(description, similar_procedures)
+        code = self.generator.generate_ui_procedure(description, similar_procedures, on_token)
         
         return code
     
-    def modify_code(self, procedure_name: str, modification_request: str) -> str:
+    def modify_code(self, procedure_name: str, modification_request: str,
+                    on_token: Optional[Callable[[str], None]] = None) -> str:
         """
         Modify an existing procedure.
         
         Args:
             procedure_name: Name of the procedure to modify
             modification_request: Description of the requested modifications
+            on_token: Optional callback invoked with each chunk of code as it is generated
             
         Returns:
             Modified T-SQL code
@@ -201,7 +314,7 @@ class TSQLCLI:
             return f"Error: Procedure {schema_name}.{procedure_name} not found"
             
         # Modify code
-        modified_code = self.generator.modify_procedure(definition, modification_request)
+        modified_code = self.generator.modify_procedure(definition, modification_request, on_token)
         
         return modified_code
     
@@ -235,6 +348,12 @@ class TSQLCLI:
         # Parse arguments
         args = parser.parse_args()
         
+        # Generated code is printed as it streams in, unless it goes to a file
+        printed = []
+        def print_token(token: str):
+            printed.append(token)
+            print(token, end="", flush=True)
+        
         # Handle commands
         if args.command == "setup":
             # Update config
@@ -283,17 +402,20 @@ class TSQLCLI:
                 return
                 
             # Generate code
-            code = self.generate_code(args.description, args.similar)
+            code = self.generate_code(args.description, args.similar, on_token=None if args.output else print_token)
             
             # Output code
             if args.output:
                 try:
-                    with open(args.output, "w") as f:
+                    with open(args.output, "w", encoding="utf-8") as f:
                         f.write(code)
                     print(f"Code written to {args.output}")
                 except Exception as e:
                     print(f"Error writing to file: {str(e)}")
                     print(code)
+            elif "".join(printed) == code:
+                # Already streamed; finish the line
+                print()
             else:
                 print(code)
                 
@@ -309,17 +431,20 @@ class TSQLCLI:
                 return
                 
             # Modify code
-            code = self.modify_code(args.procedure, args.request)
+            code = self.modify_code(args.procedure, args.request, on_token=None if args.output else print_token)
             
             # Output code
             if args.output:
                 try:
-                    with open(args.output, "w") as f:
+                    with open(args.output, "w", encoding="utf-8") as f:
                         f.write(code)
                     print(f"Code written to {args.output}")
                 except Exception as e:
                     print(f"Error writing to file: {str(e)}")
                     print(code)
+            elif "".join(printed) == code:
+                # Already streamed; finish the line
+                print()
             else:
                 print(code)
                 
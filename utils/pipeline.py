@@ -0,0 +1,76 @@
+import threading
+import queue
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+def prefetch(iterable: Iterable[T], maxsize: int = 64) -> Iterator[T]:
+    """
+    Iterate over an iterable that is consumed by a background thread.
+    
+    Lets slow I/O in the producer (e.g. streaming rows from the database)
+    overlap with work done by the consumer on each item.
+    
+    Args:
+        iterable: Items to produce
+        maxsize: Maximum number of items buffered ahead of the consumer
+    
+    Yields:
+        The items of iterable, in order; an exception raised by the producer
+        is re-raised in the consumer
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                buffer.put(item)
+        except BaseException as e:
+            buffer.put(e)
+            return
+        buffer.put(_DONE)
+    
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # Unblock the producer if the consumer stops early
+        stop.set()
+        while producer.is_alive():
+            try:
+                buffer.get_nowait()
+            except queue.Empty:
+                producer.join(timeout=0.1)
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Split an iterable into lists of at most size items.
+    
+    Args:
+        iterable: Items to split
+        size: Maximum number of items per list
+    
+    Yields:
+        Lists of consecutive items
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch